@@ -1,65 +1,468 @@
 # core_rag.py
 
 import os
-import json
-import csv # <-- ADDED THIS IMPORT for CSV handling
-from typing import List, Dict, Union
-from io import BytesIO, StringIO # <-- ADDED StringIO for CSV text decoding
+import shutil
+import tempfile
+import hashlib
+import itertools
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Union, NamedTuple, Tuple
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
+# Size the OpenMP/BLAS thread pools before numpy, torch and faiss create them. Containers often
+# default to a single thread; half the usable cores leaves room for hyper-threads and Streamlit.
+USABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+NUM_THREADS = max(1, USABLE_CPUS // 2)
+os.environ.setdefault("OMP_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(NUM_THREADS))
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import torch
 from sentence_transformers import SentenceTransformer
 import faiss
-from transformers import pipeline
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from PyPDF2 import PdfReader
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, GenerationConfig, TrainingArguments, Trainer
+from semantic_text_splitter import TextSplitter
+from document_parsers import process_file_content, PARSER_VERSION
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, GenerationConfig, TrainingArguments, Trainer, PreTrainedModel, PreTrainedTokenizerBase
+try:
+    from optimum.bettertransformer import BetterTransformer
+except ImportError: # optimum is optional; the plain encoder is used without it
+    BetterTransformer = None
+try:
+    import blake3
+except ImportError: # blake3 is optional; SHA-256 (hardware-accelerated on CPUs with SHA-NI) is used without it
+    blake3 = None
+
+faiss.omp_set_num_threads(NUM_THREADS)
+torch.set_num_threads(NUM_THREADS)
+
 # --- Configuration ---
 DOCUMENTS_DIR = "documents"
 FAISS_INDEX_PATH = "document_qa_index.faiss"
-DOC_CHUNKS_PATH = "document_chunks.json"
+DOC_CHUNKS_PATH = "document_chunks.arrow" # Arrow IPC file with one "text" row per chunk, in index order
+CHUNKS_SCHEMA = pa.schema([("text", pa.large_string())])
+CACHE_DIR = "cache" # Built indexes are kept under cache/<content hash>/ to skip rebuilds
+TEXT_CACHE_DIR = os.path.join(CACHE_DIR, "texts") # Extracted text per file, keyed by the file's content hash
+INDEX_CACHE_MAX_ENTRIES = 4 # Least recently used cached indexes beyond this are deleted
+PARALLEL_PARSE_MIN_FILES = 4 # Fewer files are parsed in-process; worker start-up would cost more than it saves
+# Never fork: this process runs Streamlit, torch/OpenMP and query-batcher threads, and forking it can
+# deadlock the workers. forkserver is unavailable on Windows, where spawn is the only start method.
+PARSE_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+CHUNK_SIZE = 500 # characters
+CHUNK_OVERLAP = 50
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+QA_MODEL_NAME = "google/flan-t5-base"
+QA_MAX_INPUT_TOKENS = 512 # flan-t5 was trained on 512-token inputs
+QA_MAX_NEW_TOKENS = 64
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_MAX_SEQ_LENGTH = 256 # Chunks are ~500 chars, so longer sequences would only add padding
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+QUERY_BATCH_MAX_SIZE = 32
+QUERY_BATCH_WINDOW_SECONDS = 0.01 # How long a batch waits for more concurrent queries
+
+# --- Index Configuration ---
+# Vectors are L2-normalized, so inner product is cosine similarity.
+# Vectors are stored as fp16 (flat tier) or 8-bit (HNSW tier) scalar codes, halving or quartering
+# the bytes scanned per query. fp16 needs no training, so incremental adds to the flat tier are exact.
+FLAT_INDEX_MAX_VECTORS = 10_000 # A linear scan is already sub-millisecond at this size
+FLAT_INDEX_SPEC = "SQfp16"
+HNSW_INDEX_SPEC = "HNSW32,SQ8"
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_PQ_INDEX_SPEC = "OPQ32,IVF1024,PQ32"
+IVF_PQ_MIN_VECTORS = 100_000 # Below this, IVF1024 has too few points per list to train well
+IVF_NPROBE = 16
+SQ_TRAIN_SAMPLE_SIZE = 4_096 # SQ8 only learns per-dimension min/max, which a few thousand vectors pin down
+IVF_PQ_TRAIN_SAMPLE_SIZE = 65_536 # IVF1024 wants ~40+ training points per list
+INDEX_ADD_BATCH_SIZE = 512 # Chunks encoded and added per step, bounding peak memory during builds
+INCREMENTAL_ADD_MAX_GROWTH = 2.0 # Trained indexes are rebuilt rather than grown beyond this factor
 
 # --- Model Loading ---
-QA_PIPELINE = AutoModelForSeq2SeqLM.from_pretrained("google/flan-t5-base",torch_dtype=torch.bfloat16)
-EMBEDDING_MODEL = AutoTokenizer.from_pretrained("google/flan-t5-base")
-# --- Document Processing Functions ---
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
-def process_file_content(file_name: str, file_content_bytes: bytes) -> Union[str, None]:
-    """Processes file content (txt, pdf, or csv bytes) and returns its text."""
-    file_extension = os.path.splitext(file_name)[1].lower()
-    text_content = ""
+class RagModels(NamedTuple):
+    """The models used by the RAG pipeline, loaded once by load_models() and passed around explicitly."""
+    embedder: SentenceTransformer
+    qa_tokenizer: PreTrainedTokenizerBase
+    qa_model: PreTrainedModel
+    query_batcher: "QueryBatcher"
 
-    if file_extension == ".txt":
+def load_embedder() -> SentenceTransformer:
+    """Loads the sentence embedding model used for both chunks and queries."""
+    embedder = SentenceTransformer(EMBEDDING_MODEL_NAME, device=DEVICE)
+    embedder.max_seq_length = EMBEDDING_MAX_SEQ_LENGTH
+    if BetterTransformer is not None:
         try:
-            text_content = file_content_bytes.decode("utf-8")
-        except UnicodeDecodeError:
-            text_content = file_content_bytes.decode("latin-1")
-    elif file_extension == ".pdf":
-        try:
-            reader = PdfReader(BytesIO(file_content_bytes))
-            for page in reader.pages:
-                text_content += page.extract_text() or ""
-        except Exception as e:
-            print(f"Error reading PDF {file_name}: {e}")
-            return None
-    elif file_extension == ".csv": # <-- ADDED THIS BLOCK for CSV handling
-        try:
-            # Decode bytes to string, then use StringIO for csv.reader
-            decoded_text = file_content_bytes.decode("utf-8")
-            csv_file = StringIO(decoded_text)
-            reader = csv.reader(csv_file)
-            rows = []
-            for row in reader:
-                rows.append(", ".join(row)) # Join columns in a row with a comma and space
-            text_content = "\n".join(rows) # Join rows with a newline
-            print(f"Processed CSV file: {file_name}")
+            # Swap the encoder layers for fused attention kernels that skip padded tokens
+            embedder[0].auto_model = BetterTransformer.transform(embedder[0].auto_model, keep_original_model=False)
         except Exception as e:
-            print(f"Error reading CSV {file_name}: {e}")
-            return None
-    else:
-        print(f"Skipped unsupported file type: {file_name}. Only .txt, .pdf, and .csv are supported.")
-        return None
-    return text_content
+            print(f"BetterTransformer not applied to {EMBEDDING_MODEL_NAME}: {e}")
+    return embedder
+
+def load_models() -> RagModels:
+    """
+    Loads the embedding model and the answer generator.
+    This is slow, so callers should load once and share the result (see get_models() in ui/app.py).
+    """
+    print(f"Loading models ({EMBEDDING_MODEL_NAME}, {QA_MODEL_NAME}) on {DEVICE}...")
+    embedder = load_embedder()
+    qa_tokenizer = AutoTokenizer.from_pretrained(QA_MODEL_NAME)
+    qa_model = AutoModelForSeq2SeqLM.from_pretrained(QA_MODEL_NAME, torch_dtype=torch.bfloat16).to(DEVICE).eval()
+    if hasattr(torch, "compile"):
+        # Compile the forward pass that generate() calls for every decoding step.
+        # Fall back to eager kernels if this host cannot compile (e.g. no C++ toolchain).
+        torch._dynamo.config.suppress_errors = True
+        qa_model.forward = torch.compile(qa_model.forward, dynamic=True)
+    models = RagModels(embedder=embedder, qa_tokenizer=qa_tokenizer, qa_model=qa_model,
+                       query_batcher=QueryBatcher(embedder))
+    warm_up_models(models)
+    return models
+
+def embed_texts(embedder: SentenceTransformer, texts: List[str]) -> np.ndarray:
+    """Encodes texts in batches and returns L2-normalized float32 vectors laid out contiguously for FAISS."""
+    with torch.inference_mode():
+        vectors = embedder.encode(texts,
+                                  batch_size=EMBEDDING_BATCH_SIZE,
+                                  convert_to_numpy=True,
+                                  normalize_embeddings=True,
+                                  show_progress_bar=False)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors) # Defensive: inner-product search relies on unit-length vectors
+    return vectors
+
+class QueryBatcher:
+    """
+    Encodes queries from concurrent sessions together. Queries that pile up while a batch is being
+    encoded, or that arrive within a short window of each other, go through the embedder as one
+    batch; a lone query is encoded right away. Results are memoized in an LRU cache.
+
+    The batcher runs its own event loop on a daemon thread, so encode() can be awaited from any
+    thread's event loop (Streamlit runs each session's script in its own thread).
+    """
+
+    def __init__(self, embedder: SentenceTransformer,
+                 max_batch_size: int = QUERY_BATCH_MAX_SIZE,
+                 window_seconds: float = QUERY_BATCH_WINDOW_SECONDS,
+                 cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="query-batcher", daemon=True).start()
+        # The queue must be created on the batcher's own loop
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        self._queue = asyncio.Queue()
+        self._drain_task = asyncio.ensure_future(self._drain())
+
+    async def encode(self, query: str) -> np.ndarray:
+        """Returns the query's (1, d) embedding. The array may be shared through the cache; do not modify it."""
+        with self._cache_lock:
+            if query in self._cache:
+                self._cache.move_to_end(query)
+                return self._cache[query]
+
+        vector = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._submit(query), self._loop))
+
+        with self._cache_lock:
+            self._cache[query] = vector
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    async def _submit(self, query: str) -> np.ndarray:
+        result = self._loop.create_future()
+        await self._queue.put((query, result))
+        return await result
+
+    async def _drain(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                if len(batch) == 1 and self._queue.empty():
+                    break # Nothing else is pending, so don't make a lone query wait for company
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Identical queries arriving together are encoded once and the row is shared by their callers
+            query_rows = {query: i for i, query in enumerate(dict.fromkeys(query for query, _ in batch))}
+            try:
+                # Encode off the loop so new queries keep queueing up for the next batch meanwhile
+                vectors = await self._loop.run_in_executor(None, embed_texts, self.embedder, list(query_rows))
+            except Exception as e:
+                for _, result in batch:
+                    if not result.done():
+                        result.set_exception(e)
+                continue
+            for query, result in batch:
+                if not result.done():
+                    row = query_rows[query]
+                    result.set_result(vectors[row:row + 1])
+
+def warm_up_models(models: RagModels):
+    """
+    Runs one tiny encode and generate so weight allocation, kernel selection and torch.compile
+    happen at load time instead of stalling the first user query.
+    """
+    try:
+        embed_texts(models.embedder, ["warmup"])
+        generate_answer(models, "warmup")
+    except Exception as e:
+        print(f"Model warm-up failed; the first query may be slow: {e}")
+
+def generate_answer(models: RagModels, prompt: str) -> str:
+    """Greedily decodes an answer for the prompt, reusing the KV-cache across decoding steps."""
+    inputs = models.qa_tokenizer(prompt, return_tensors="pt", truncation=True, max_length=QA_MAX_INPUT_TOKENS).to(DEVICE)
+    with torch.inference_mode():
+        output_ids = models.qa_model.generate(**inputs,
+                                              max_new_tokens=QA_MAX_NEW_TOKENS,
+                                              num_beams=1,
+                                              use_cache=True)
+    return models.qa_tokenizer.decode(output_ids[0], skip_special_tokens=True)
+
+# --- Index Helpers ---
+_GPU_RESOURCES = None
+# Knowledge base loaded for answering queries, reloaded whenever the index file's mtime changes
+_INDEX = None
+_CHUNKS_TABLE = None
+_INDEX_MTIME = 0.0
+
+def get_index_spec(num_vectors: int) -> str:
+    """
+    Returns the FAISS factory spec for a corpus of this size: a flat fp16 index for small corpora,
+    an HNSW graph over SQ8 codes for medium ones and a compressed OPQ+IVF+PQ index for large ones.
+    """
+    if num_vectors <= FLAT_INDEX_MAX_VECTORS:
+        return FLAT_INDEX_SPEC
+    if num_vectors < IVF_PQ_MIN_VECTORS:
+        return HNSW_INDEX_SPEC
+    return IVF_PQ_INDEX_SPEC
+
+def create_faiss_index(num_vectors: int, dimension: int) -> faiss.Index:
+    """Creates an inner-product index sized for the expected number of vectors. Check is_trained before adding."""
+    index = faiss.index_factory(dimension, get_index_spec(num_vectors), faiss.METRIC_INNER_PRODUCT)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return index
+
+def train_faiss_index(index: faiss.Index, embedder: SentenceTransformer, chunks: List[str]):
+    """
+    Trains the index quantizers on the embeddings of a bounded random sample of the chunks.
+    The sample is encoded separately from the streaming adds, so memory stays bounded by the
+    sample size rather than the corpus size.
+    """
+    sample_size = IVF_PQ_TRAIN_SAMPLE_SIZE if faiss.try_extract_index_ivf(index) is not None else SQ_TRAIN_SAMPLE_SIZE
+    if len(chunks) > sample_size:
+        sample_ids = np.sort(np.random.default_rng(0).choice(len(chunks), sample_size, replace=False))
+        chunks = [chunks[i] for i in sample_ids]
+    index.train(embed_texts(embedder, chunks))
+
+def set_search_params(index: faiss.Index):
+    """Applies the query-time accuracy/speed knobs for whichever index type was loaded."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return
+    try:
+        faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    except RuntimeError:
+        pass # Not an IVF index; nothing to tune
+
+def index_to_device(index: faiss.Index) -> faiss.Index:
+    """
+    Moves the index to the first GPU when the GPU build of FAISS and a device are available.
+    FAISS has no GPU implementation of the flat scalar-quantizer or HNSW indexes, so in practice
+    only the OPQ+IVF+PQ tier (IVF_PQ_MIN_VECTORS and up) is moved; smaller tiers stay on the CPU.
+    """
+    global _GPU_RESOURCES
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return index
+    try:
+        if _GPU_RESOURCES is None:
+            _GPU_RESOURCES = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(_GPU_RESOURCES, 0, index)
+    except Exception as e:
+        print(f"Keeping FAISS index on CPU: {e}")
+        return index
 
-def build_faiss_index(document_texts: List[str]):
+def new_content_hasher(data: bytes = b""):
+    """Returns a hashlib-style hasher for content hashes: BLAKE3 when installed, SHA-256 otherwise."""
+    return blake3.blake3(data) if blake3 is not None else hashlib.sha256(data)
+
+def compute_corpus_hash(document_texts: List[str]) -> str:
+    """Returns a cache key covering the document texts and the settings that shape the index."""
+    index_settings = (EMBEDDING_MODEL_NAME, EMBEDDING_MAX_SEQ_LENGTH, CHUNK_SIZE, CHUNK_OVERLAP,
+                      FLAT_INDEX_SPEC, FLAT_INDEX_MAX_VECTORS, HNSW_INDEX_SPEC, HNSW_EF_CONSTRUCTION,
+                      IVF_PQ_INDEX_SPEC, IVF_PQ_MIN_VECTORS)
+    hash_builder = new_content_hasher("|".join(map(str, index_settings)).encode("utf-8"))
+    for text in document_texts:
+        hash_builder.update(b"\0")
+        hash_builder.update(text.encode("utf-8"))
+    return hash_builder.hexdigest()
+
+def install_file(source_path: str, destination_path: str):
+    """
+    Copies a file into place via a temporary file and an atomic rename. The chunks (and, depending
+    on the index type, the index) are memory-mapped while serving queries, and overwriting them in
+    place would corrupt live mappings.
+    """
+    temp_path = destination_path + ".tmp"
+    shutil.copy(source_path, temp_path)
+    os.replace(temp_path, destination_path)
+
+def restore_cached_index(corpus_hash: str) -> bool:
+    """Copies a previously built index and its chunks into place. Returns True on a cache hit."""
+    cache_dir = os.path.join(CACHE_DIR, corpus_hash)
+    cached_index_path = os.path.join(cache_dir, os.path.basename(FAISS_INDEX_PATH))
+    cached_chunks_path = os.path.join(cache_dir, os.path.basename(DOC_CHUNKS_PATH))
+    if not (os.path.exists(cached_index_path) and os.path.exists(cached_chunks_path)):
+        return False
+    # Chunks first: the index file's mtime is what signals load_knowledge_base to reload both
+    install_file(cached_chunks_path, DOC_CHUNKS_PATH)
+    install_file(cached_index_path, FAISS_INDEX_PATH)
+    os.utime(cache_dir) # Mark as recently used for evict_index_cache
+    return True
+
+def save_index_to_cache(corpus_hash: str):
+    """Stores the freshly built index and chunks under the corpus hash, then evicts old entries."""
+    cache_dir = os.path.join(CACHE_DIR, corpus_hash)
+    os.makedirs(cache_dir, exist_ok=True)
+    install_file(FAISS_INDEX_PATH, os.path.join(cache_dir, os.path.basename(FAISS_INDEX_PATH)))
+    install_file(DOC_CHUNKS_PATH, os.path.join(cache_dir, os.path.basename(DOC_CHUNKS_PATH)))
+    os.utime(cache_dir)
+    evict_index_cache()
+
+def evict_index_cache():
+    """Deletes the least recently used cached indexes so at most INDEX_CACHE_MAX_ENTRIES remain."""
+    cache_dirs = [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)]
+    cache_dirs = [path for path in cache_dirs if os.path.isdir(path) and path != TEXT_CACHE_DIR]
+    cache_dirs.sort(key=os.path.getmtime, reverse=True)
+    for stale_dir in cache_dirs[INDEX_CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(stale_dir, ignore_errors=True)
+        print(f"Evicted cached FAISS index {os.path.basename(stale_dir)}.")
+
+# --- Document Processing Functions ---
+
+def process_files_content(files: List[Tuple[str, bytes]]) -> List[Union[str, None]]:
+    """
+    Processes (file name, file bytes) pairs with process_file_content, preserving order.
+    Larger batches are spread over worker processes so PDF, CSV and text parsing of different files
+    runs in parallel instead of serially under the GIL.
+    """
+    if len(files) < PARALLEL_PARSE_MIN_FILES:
+        return [process_file_content(file_name, file_content_bytes) for file_name, file_content_bytes in files]
+    file_names, file_contents = zip(*files)
+    # Workers start from a fresh interpreter (see PARSE_START_METHOD). They import document_parsers,
+    # which avoids torch/faiss/transformers, plus whatever the launching __main__ script imports.
+    with ProcessPoolExecutor(max_workers=min(len(files), USABLE_CPUS),
+                             mp_context=multiprocessing.get_context(PARSE_START_METHOD)) as executor:
+        return list(executor.map(process_file_content, file_names, file_contents))
+
+def get_text_cache_path(file_name: str, file_hash: str) -> str:
+    """
+    Returns where the extracted text of a file is cached. The extension is part of the key since it
+    picks the parser, and the parser version so parser changes are not masked by old cache entries.
+    """
+    file_extension = os.path.splitext(file_name)[1].lower()
+    return os.path.join(TEXT_CACHE_DIR, f"{file_hash}.v{PARSER_VERSION}{file_extension}.txt")
+
+def process_files(files: List[Tuple[str, bytes]]) -> List[Tuple[str, Union[str, None], str]]:
+    """
+    Processes (file name, file bytes) pairs and returns (file name, text, content hash of bytes) triples in order.
+    Files whose content was processed before are served from the text cache; the rest are parsed
+    once with process_files_content and their text is cached for next time.
+    """
+    file_hashes = [new_content_hasher(file_content_bytes).hexdigest() for _, file_content_bytes in files]
+    texts = []
+    for (file_name, _), file_hash in zip(files, file_hashes):
+        cache_path = get_text_cache_path(file_name, file_hash)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+        else:
+            texts.append(None)
+
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if missing:
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+        for i, text in zip(missing, process_files_content([files[i] for i in missing])):
+            texts[i] = text
+            if text is not None:
+                # Write to a unique temp file and rename, so concurrent sessions never read a partial entry
+                temp_fd, temp_path = tempfile.mkstemp(dir=TEXT_CACHE_DIR, suffix=".tmp")
+                with open(temp_fd, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(temp_path, get_text_cache_path(files[i][0], file_hashes[i]))
+
+    return [(file_name, text, file_hash) for (file_name, _), text, file_hash in zip(files, texts, file_hashes)]
+
+def load_knowledge_base():
+    """
+    Returns the (index, chunks table) pair for querying, reading them from disk only when the
+    index file has changed since the last load. The chunks table is memory-mapped, so a query
+    only touches the chunks it retrieves. The index is memory-mapped where FAISS supports it for
+    that index type: IVF inverted lists via IO_FLAG_MMAP, and flat/HNSW codes via IO_FLAG_MMAP_IFC
+    on FAISS builds that have it. Anything else is read into RAM.
+    """
+    global _INDEX, _CHUNKS_TABLE, _INDEX_MTIME
+    mtime = os.path.getmtime(FAISS_INDEX_PATH)
+    if _INDEX is None or mtime != _INDEX_MTIME:
+        chunks_table = pa.ipc.open_file(pa.memory_map(DOC_CHUNKS_PATH, 'r')).read_all()
+        # The two mmap flags cannot be combined (FAISS rejects MMAP|MMAP_IFC for IVF indexes), so
+        # pick the one matching the tier, which follows from the chunk count (one row per vector)
+        if get_index_spec(chunks_table.num_rows) == IVF_PQ_INDEX_SPEC:
+            mmap_flag = faiss.IO_FLAG_MMAP
+        else:
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        index = faiss.read_index(FAISS_INDEX_PATH, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        set_search_params(index)
+        _INDEX, _CHUNKS_TABLE, _INDEX_MTIME = index_to_device(index), chunks_table, mtime
+    return _INDEX, _CHUNKS_TABLE
+
+def split_documents(document_texts: List[str]) -> List[str]:
+    """Splits documents into overlapping chunks, dropping duplicates while keeping first-occurrence order."""
+    splitter = TextSplitter(capacity=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+    all_chunks = list(itertools.chain.from_iterable(splitter.chunks(doc_text) for doc_text in document_texts))
+    # Repeated boilerplate (headers, footers, disclaimers) is embedded and stored only once
+    num_chunks = len(all_chunks)
+    all_chunks = list(dict.fromkeys(all_chunks))
+    if len(all_chunks) < num_chunks:
+        print(f"Skipped {num_chunks - len(all_chunks)} duplicate chunks.")
+    return all_chunks
+
+def add_chunks_to_index(index: faiss.Index, chunks_writer: pa.ipc.RecordBatchFileWriter, embedder: SentenceTransformer,
+                        chunks: List[str]):
+    """
+    Streams chunks through the encoder and into the index and the chunks file, one batch at a time,
+    so only one batch of vectors is held at once.
+    """
+    for start in range(0, len(chunks), INDEX_ADD_BATCH_SIZE):
+        batch = chunks[start:start + INDEX_ADD_BATCH_SIZE]
+        vectors = embed_texts(embedder, batch)
+        index.add(vectors)
+        chunks_writer.write_batch(pa.record_batch([pa.array(batch, type=pa.large_string())], schema=CHUNKS_SCHEMA))
+
+def write_faiss_index(index: faiss.Index):
+    """Writes the index next to FAISS_INDEX_PATH and renames it into place (see install_file)."""
+    index_temp_path = FAISS_INDEX_PATH + ".tmp"
+    faiss.write_index(index, index_temp_path)
+    os.replace(index_temp_path, FAISS_INDEX_PATH)
+    print(f"FAISS index saved to {FAISS_INDEX_PATH}")
+
+def build_faiss_index(document_texts: List[str], embedder: SentenceTransformer):
     """
     Builds or rebuilds the FAISS index and saves chunks from a list of document texts.
     """
@@ -71,37 +474,88 @@ def build_faiss_index(document_texts: List[str]):
             os.remove(DOC_CHUNKS_PATH)
         return False # Indicate no index was built
 
+    corpus_hash = compute_corpus_hash(document_texts)
+    if restore_cached_index(corpus_hash):
+        print(f"Reused cached FAISS index for unchanged documents ({corpus_hash}).")
+        return True
+
     print(f"Chunking {len(document_texts)} documents...")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    all_chunks = []
-    for doc_text in document_texts:
-        chunks = splitter.split_text(doc_text)
-        all_chunks.extend(chunks)
+    all_chunks = split_documents(document_texts)
 
     if not all_chunks:
         print("No chunks generated from the provided documents. Index will not be built.")
         return False
 
-    print(f"Encoding {len(all_chunks)} chunks...")
-    vectors = EMBEDDING_MODEL.encode(all_chunks, convert_to_numpy=True)
-
     print("Creating FAISS index...")
-    index = faiss.IndexFlatL2(vectors.shape[1])
-    index.add(vectors)
+    index = create_faiss_index(len(all_chunks), embedder.get_sentence_embedding_dimension())
+    if not index.is_trained:
+        train_faiss_index(index, embedder, all_chunks)
 
-    faiss.write_index(index, FAISS_INDEX_PATH)
-    print(f"FAISS index saved to {FAISS_INDEX_PATH}")
-
-    with open(DOC_CHUNKS_PATH, 'w', encoding='utf-8') as f:
-        json.dump(all_chunks, f, ensure_ascii=False, indent=2)
+    print(f"Encoding and indexing {len(all_chunks)} chunks...")
+    # Files are written next to their targets and renamed into place (see install_file)
+    chunks_temp_path = DOC_CHUNKS_PATH + ".tmp"
+    with pa.ipc.new_file(chunks_temp_path, CHUNKS_SCHEMA) as chunks_writer:
+        add_chunks_to_index(index, chunks_writer, embedder, all_chunks)
+    os.replace(chunks_temp_path, DOC_CHUNKS_PATH)
     print(f"Chunks saved to {DOC_CHUNKS_PATH}")
+
+    write_faiss_index(index)
+    save_index_to_cache(corpus_hash)
     print("FAISS Index Building Complete!")
     return True # Indicate success
 
-def get_answer_from_rag(query: str, top_k: int = 3) -> Dict:
+def add_documents(new_document_texts: List[str], embedder: SentenceTransformer, corpus_texts: List[str]):
     """
-    Performs the RAG process: retrieves context and gets an answer from the QA pipeline.
-    Returns a dictionary with 'answer', 'score', and 'context'.
+    Adds documents to the existing FAISS index and chunks file, encoding only their new chunks.
+    corpus_texts must hold every document in the knowledge base after the add; the index is rebuilt
+    from them instead when there is no index yet, when the add moves the corpus into another index
+    tier, or when it would grow an index with trained quantizers (SQ8, PQ) well past the data those
+    were trained on, since FAISS clamps new vectors to the trained ranges.
+    Incrementally grown indexes are not stored in the index cache; only fresh builds are.
+    """
+    if not (os.path.exists(FAISS_INDEX_PATH) and os.path.exists(DOC_CHUNKS_PATH)):
+        return build_faiss_index(corpus_texts, embedder)
+
+    print(f"Chunking {len(new_document_texts)} new documents...")
+    existing_chunks_table = pa.ipc.open_file(pa.memory_map(DOC_CHUNKS_PATH, 'r')).read_all()
+    candidate_chunks = pa.array(split_documents(new_document_texts), type=pa.large_string())
+    # Look the candidates up on the Arrow side instead of materializing every stored chunk in Python
+    already_stored = pc.is_in(candidate_chunks, value_set=existing_chunks_table.column("text").combine_chunks())
+    new_chunks = pc.filter(candidate_chunks, pc.invert(already_stored)).to_pylist()
+
+    if not new_chunks:
+        print("No new chunks to add; the knowledge base already contains this content.")
+        return True
+
+    num_existing = existing_chunks_table.num_rows # One row per indexed vector
+    num_total = num_existing + len(new_chunks)
+    current_spec = get_index_spec(num_existing)
+    if get_index_spec(num_total) != current_spec:
+        print(f"Adding {len(new_chunks)} chunks moves the corpus to another index type; rebuilding.")
+        return build_faiss_index(corpus_texts, embedder)
+    if current_spec != FLAT_INDEX_SPEC and num_total > INCREMENTAL_ADD_MAX_GROWTH * num_existing:
+        print(f"Adding {len(new_chunks)} chunks outgrows the index's trained quantizer; rebuilding.")
+        return build_faiss_index(corpus_texts, embedder)
+
+    # Read without memory-mapping: the index is modified and written back
+    index = faiss.read_index(FAISS_INDEX_PATH)
+    print(f"Encoding and adding {len(new_chunks)} chunks to the existing index...")
+    # Arrow IPC files cannot be appended in place, so the existing rows are copied into a new file
+    chunks_temp_path = DOC_CHUNKS_PATH + ".tmp"
+    with pa.ipc.new_file(chunks_temp_path, CHUNKS_SCHEMA) as chunks_writer:
+        chunks_writer.write_table(existing_chunks_table)
+        add_chunks_to_index(index, chunks_writer, embedder, new_chunks)
+    os.replace(chunks_temp_path, DOC_CHUNKS_PATH)
+    print(f"Chunks saved to {DOC_CHUNKS_PATH}")
+    write_faiss_index(index)
+    print("FAISS Index Update Complete!")
+    return True
+
+async def get_answer_from_rag(query: str, models: RagModels, top_k: int = 3) -> Dict:
+    """
+    Performs the RAG process: retrieves context and generates an answer from it.
+    The query embedding is batched with other sessions' queries through models.query_batcher.
+    Returns a dictionary with 'answer', 'score' (cosine similarity of the best chunk), and 'context'.
     """
     if not os.path.exists(FAISS_INDEX_PATH) or not os.path.exists(DOC_CHUNKS_PATH):
         return {"answer": "Error: Knowledge base not built. Please upload documents and build the index.",
@@ -109,18 +563,17 @@ def get_answer_from_rag(query: str, top_k: int = 3) -> Dict:
                 "context": ""}
 
     try:
-        index = faiss.read_index(FAISS_INDEX_PATH)
-        with open(DOC_CHUNKS_PATH, 'r', encoding='utf-8') as f:
-            chunks = json.load(f)
+        index, chunks_table = load_knowledge_base()
     except Exception as e:
         print(f"Error loading index or chunks: {e}")
         return {"answer": "An error occurred while loading the knowledge base.",
                 "score": 0.0,
                 "context": ""}
 
-    query_vec = EMBEDDING_MODEL.encode([query], convert_to_numpy=True)
+    query_vec = await models.query_batcher.encode(query)
     D, I = index.search(query_vec, top_k)
-    retrieved_chunks = [chunks[i] for i in I[0]]
+    hits = [(score, i) for score, i in zip(D[0], I[0]) if i >= 0] # FAISS pads missing hits with -1
+    retrieved_chunks = chunks_table.column("text").take([i for _, i in hits]).to_pylist()
 
     context_for_qa = "\n\n".join(retrieved_chunks)
 
@@ -129,10 +582,15 @@ def get_answer_from_rag(query: str, top_k: int = 3) -> Dict:
                 "score": 0.0,
                 "context": ""}
 
+    prompt = (
+        "Answer the question based on the context below.\n\n"
+        f"Context: {context_for_qa}\n\n"
+        f"Question: {query}"
+    )
     try:
-        qa_result = QA_PIPELINE(question=query, context=context_for_qa)
-        return {"answer": qa_result['answer'],
-                "score": qa_result['score'],
+        answer = generate_answer(models, prompt)
+        return {"answer": answer,
+                "score": float(hits[0][0]),
                 "context": context_for_qa}
     except Exception as e:
         print(f"Error during question answering: {e}")
@@ -0,0 +1,78 @@
+# document_parsers.py
+# Text extraction for uploaded files. Kept free of model/index imports so that parser worker
+# processes (see core_rag.process_files_content) start quickly.
+
+import os
+import csv
+from typing import Union
+from io import BytesIO, StringIO
+
+import pandas as pd
+import pypdfium2 as pdfium
+
+PARSER_VERSION = 3 # Bump whenever extracted text changes, so cached texts from older parsers are not reused
+
+def process_file_content(file_name: str, file_content_bytes: bytes) -> Union[str, None]:
+    """Processes file content (txt, pdf, or csv bytes) and returns its text."""
+    file_extension = os.path.splitext(file_name)[1].lower()
+    text_content = ""
+
+    if file_extension == ".txt":
+        try:
+            text_content = file_content_bytes.decode("utf-8")
+        except UnicodeDecodeError:
+            text_content = file_content_bytes.decode("latin-1")
+    elif file_extension == ".pdf":
+        try:
+            pdf = pdfium.PdfDocument(file_content_bytes)
+            try:
+                page_texts = []
+                for page in pdf:
+                    text_page = page.get_textpage()
+                    page_texts.append(text_page.get_text_range())
+                    # Free native PDFium memory as we go rather than waiting for GC
+                    text_page.close()
+                    page.close()
+                text_content = "\n".join(page_texts)
+            finally:
+                pdf.close()
+        except Exception as e:
+            print(f"Error reading PDF {file_name}: {e}")
+            return None
+    elif file_extension == ".csv": # <-- ADDED THIS BLOCK for CSV handling
+        try:
+            text_content = csv_to_text(file_content_bytes)
+            print(f"Processed CSV file: {file_name}")
+        except Exception as e:
+            print(f"Error reading CSV {file_name}: {e}")
+            return None
+    else:
+        print(f"Skipped unsupported file type: {file_name}. Only .txt, .pdf, and .csv are supported.")
+        return None
+    return text_content
+
+def csv_to_text(file_content_bytes: bytes) -> str:
+    """
+    Renders CSV bytes as text: cells joined by ", ", rows joined by newlines.
+    Rectangular files are parsed with pandas' C engine; ragged files (rows with more or fewer fields
+    than the first, or blank lines) go through the csv module so every row keeps its own fields.
+    """
+    # pandas pads short rows and blank lines with "" under dtype=str, which is indistinguishable from
+    # empty cells afterwards, so raggedness has to be checked on the raw rows before taking its path.
+    field_counts = set(map(len, csv.reader(StringIO(file_content_bytes.decode("utf-8")))))
+    if not field_counts:
+        return ""
+    if len(field_counts) > 1 or 0 in field_counts:
+        return csv_to_text_by_rows(file_content_bytes)
+
+    # header=None keeps the header row as text like any other row
+    df = pd.read_csv(BytesIO(file_content_bytes), header=None, dtype=str, keep_default_na=False,
+                     skip_blank_lines=False, encoding="utf-8", engine="c")
+    columns = [df[column] for column in df.columns]
+    rows = columns[0].str.cat(columns[1:], sep=", ") if len(columns) > 1 else columns[0] # Join columns in a row with a comma and space
+    return rows.str.cat(sep="\n") # Join rows with a newline
+
+def csv_to_text_by_rows(file_content_bytes: bytes) -> str:
+    """Row-by-row csv module rendering used for ragged CSVs, with the same output format as csv_to_text."""
+    reader = csv.reader(StringIO(file_content_bytes.decode("utf-8")))
+    return "\n".join(", ".join(row) for row in reader)
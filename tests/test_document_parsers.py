@@ -0,0 +1,36 @@
+import csv
+from io import StringIO
+
+import pytest
+
+from document_parsers import csv_to_text
+
+
+def csv_reader_text(file_content_bytes: bytes) -> str:
+    """The csv.reader rendering csv_to_text replaced, which its output must keep matching."""
+    reader = csv.reader(StringIO(file_content_bytes.decode("utf-8")))
+    return "\n".join(", ".join(row) for row in reader)
+
+
+@pytest.mark.parametrize("file_content_bytes", [
+    b"a,b,c\n1,2,3\n",          # Rectangular
+    b"a,b,c\n1,,3\n,,\n",       # Rectangular with empty cells
+    b'a,b\n"x, y","multi\nline"\n', # Quoted delimiters and newlines
+    b"a\nb\nc\n",               # Single column
+    b"a,b,c\n1,2\n",            # Short row
+    b"a,b\n1,2,3\n",            # Long row
+    b"a,b\n\n1,2\n",            # Blank line in the middle
+    b"a,b\n1,2\n\n",            # Trailing blank line
+    b"a\n\nb\n",                # Blank line in a single column
+])
+def test_csv_to_text_matches_csv_reader(file_content_bytes):
+    assert csv_to_text(file_content_bytes) == csv_reader_text(file_content_bytes)
+
+
+def test_csv_to_text_pins_ragged_output():
+    assert csv_to_text(b"a,b,c\n1,2\n") == "a, b, c\n1, 2"
+    assert csv_to_text(b"a,b\n\n1,2\n") == "a, b\n\n1, 2"
+
+
+def test_csv_to_text_empty_file():
+    assert csv_to_text(b"") == ""
@@ -2,7 +2,7 @@
 
 import streamlit as st
 import os
-import hashlib # For better hashing of content
+import asyncio
 from io import BytesIO
 
 # Import functions and models from the core RAG logic
@@ -23,26 +23,37 @@ if 'document_count' not in st.session_state:
 if 'current_documents_hash' not in st.session_state:
     st.session_state['current_documents_hash'] = None # To detect changes in uploaded files
 
-# --- Helper to get current document texts ---
+# --- Shared Models ---
+@st.cache_resource
+def get_models():
+    """Loads the RAG models once per server process and shares them across sessions and reruns."""
+    return core_rag.load_models()
+
+# --- Helpers to get current document texts ---
+def compute_documents_hash(file_hashes):
+    """Combines per-file content hashes into one hash for the whole document set."""
+    content_hash_builder = core_rag.new_content_hasher()
+    for file_hash in file_hashes:
+        content_hash_builder.update(file_hash.encode('utf-8'))
+    return content_hash_builder.hexdigest()
+
 def get_current_document_texts_from_disk():
     """Reads all existing documents from the documents/ directory and returns their texts and a content hash."""
-    doc_texts = []
-    content_hash_builder = hashlib.md5() # Use MD5 for a content hash
+    files = []
 
     if os.path.exists(core_rag.DOCUMENTS_DIR):
-        for filename in os.listdir(core_rag.DOCUMENTS_DIR):
+        for filename in sorted(os.listdir(core_rag.DOCUMENTS_DIR)): # Stable order keeps the hashes stable
             file_path = os.path.join(core_rag.DOCUMENTS_DIR, filename)
             if os.path.isfile(file_path):
                 try:
                     with open(file_path, 'rb') as f:
-                        file_content_bytes = f.read()
-                    content_hash_builder.update(file_content_bytes) # Update hash with content
-                    text = core_rag.process_file_content(filename, file_content_bytes)
-                    if text:
-                        doc_texts.append(text)
+                        files.append((filename, f.read()))
                 except Exception as e:
                     st.warning(f"Could not read file {filename} from disk: {e}")
-    return doc_texts, content_hash_builder.hexdigest()
+
+    processed_files = core_rag.process_files(files) # Cached texts skip PDF/CSV parsing entirely
+    doc_texts = [text for _, text, _ in processed_files if text]
+    return doc_texts, compute_documents_hash(file_hash for _, _, file_hash in processed_files)
 
 # --- Initial/Reload Indexing ---
 @st.cache_resource
@@ -54,7 +65,7 @@ def initial_index_build():
     # Only build if there are documents and the hash doesn't match a previously built index
     # (This simple hash check is a basic cache key for `st.cache_resource`)
     if doc_texts:
-        if core_rag.build_faiss_index(doc_texts):
+        if core_rag.build_faiss_index(doc_texts, get_models().embedder):
             st.session_state['index_built'] = True
             st.session_state['document_count'] = len(doc_texts)
             st.session_state['current_documents_hash'] = current_hash # Store the hash of the indexed content
@@ -76,53 +87,71 @@ initial_index_build()
 # --- File Uploader Section ---
 st.header("1. Upload New Documents (Optional)")
 uploaded_files = st.file_uploader(
-    "Upload .txt, .pdf, or .csv files to add to the knowledge base (Existing files will be replaced).",
+    "Upload .txt, .pdf, or .csv files to add to the knowledge base.",
     type=["txt", "pdf", "csv"], # <-- ADDED "csv" here
     accept_multiple_files=True,
-    help="Uploading new files will rebuild the entire knowledge base with the new content."
+    help="New files are added to the existing knowledge base. Use 'Reset & Rebuild' to replace all existing documents instead."
 )
 
 if uploaded_files:
-    if st.button("Process & Rebuild Knowledge Base"):
+    add_column, reset_column = st.columns(2)
+    add_clicked = add_column.button("Add to Knowledge Base")
+    reset_clicked = reset_column.button("Reset & Rebuild Knowledge Base")
+    if add_clicked or reset_clicked:
         new_doc_texts_from_upload = []
-        
-        with st.spinner("Clearing existing documents and saving new ones..."):
-            # 1. Clear ALL existing files from the documents directory first
-            if os.path.exists(core_rag.DOCUMENTS_DIR):
+        replaces_existing_file = False # Changed content under an existing name leaves stale chunks unless we rebuild
+
+        with st.spinner("Saving uploaded documents..."):
+            # 1. On reset, clear ALL existing files from the documents directory first
+            if reset_clicked and os.path.exists(core_rag.DOCUMENTS_DIR):
                 for f in os.listdir(core_rag.DOCUMENTS_DIR):
                     file_path = os.path.join(core_rag.DOCUMENTS_DIR, f)
                     if os.path.isfile(file_path):
                         os.remove(file_path)
-            st.info(f"Cleared existing documents from '{core_rag.DOCUMENTS_DIR}'.")
+                st.info(f"Cleared existing documents from '{core_rag.DOCUMENTS_DIR}'.")
 
-            # 2. Save the NEWLY uploaded files to the now-empty documents directory
+            # 2. Save the uploaded files to the documents directory
+            saved_files = []
             for uploaded_file in uploaded_files:
                 file_content_bytes = uploaded_file.getvalue()
                 file_path_on_disk = os.path.join(core_rag.DOCUMENTS_DIR, uploaded_file.name)
                 try:
+                    if os.path.isfile(file_path_on_disk):
+                        with open(file_path_on_disk, "rb") as f:
+                            replaces_existing_file = replaces_existing_file or f.read() != file_content_bytes
                     with open(file_path_on_disk, "wb") as f:
                         f.write(file_content_bytes)
-                    text = core_rag.process_file_content(uploaded_file.name, file_content_bytes)
-                    if text:
-                        new_doc_texts_from_upload.append(text)
-                    st.success(f"Saved and processed: {uploaded_file.name}")
+                    saved_files.append((uploaded_file.name, file_content_bytes))
                 except Exception as e:
-                    st.error(f"Error saving/processing {uploaded_file.name}: {e}")
-        
-        with st.spinner("Rebuilding knowledge base with new documents..."):
-            if core_rag.build_faiss_index(new_doc_texts_from_upload):
-                st.session_state['index_built'] = True
-                st.session_state['document_count'] = len(new_doc_texts_from_upload)
-                # Compute hash for the new set of documents to reflect changes
-                current_hash_builder = hashlib.md5()
-                for text in new_doc_texts_from_upload:
-                    current_hash_builder.update(text.encode('utf-8')) # Hash the text content
-                st.session_state['current_documents_hash'] = current_hash_builder.hexdigest()
-                st.success(f"Knowledge base rebuilt successfully with {st.session_state['document_count']} documents!")
-            else:
-                st.session_state['index_built'] = False
-                st.session_state['document_count'] = 0
-                st.error("Failed to rebuild knowledge base. Check logs for errors during file processing or indexing.")
+                    st.error(f"Error saving {uploaded_file.name}: {e}")
+
+            # 3. Extract text from all saved files in one batch, reusing cached text for known content
+            for file_name, text, _ in core_rag.process_files(saved_files):
+                if text:
+                    new_doc_texts_from_upload.append(text)
+                    st.success(f"Saved and processed: {file_name}")
+                else:
+                    st.error(f"Error processing {file_name}: no text could be extracted.")
+
+        # Every document now on disk; their texts come from the text cache, so nothing is parsed again
+        doc_texts_on_disk, disk_hash = get_current_document_texts_from_disk()
+        if reset_clicked or replaces_existing_file:
+            with st.spinner("Rebuilding knowledge base..."):
+                succeeded = core_rag.build_faiss_index(doc_texts_on_disk, get_models().embedder)
+        else:
+            with st.spinner("Adding new documents to the knowledge base..."):
+                succeeded = core_rag.add_documents(new_doc_texts_from_upload, get_models().embedder,
+                                                   corpus_texts=doc_texts_on_disk)
+
+        if succeeded:
+            st.session_state['index_built'] = True
+            st.session_state['document_count'] = len(doc_texts_on_disk)
+            st.session_state['current_documents_hash'] = disk_hash
+            st.success(f"Knowledge base updated successfully with {st.session_state['document_count']} documents!")
+        else:
+            st.session_state['index_built'] = False
+            st.session_state['document_count'] = 0
+            st.error("Failed to update knowledge base. Check logs for errors during file processing or indexing.")
         st.rerun() # Rerun to update state/UI properly
 else:
     # If no files are currently selected in the uploader, check the status from disk
@@ -134,7 +163,7 @@ else:
         if doc_texts_on_disk and disk_hash != st.session_state.get('current_documents_hash'):
             # Only rebuild if content on disk has changed and index is not built
             with st.spinner("Checking for existing documents and building index..."):
-                if core_rag.build_faiss_index(doc_texts_on_disk):
+                if core_rag.build_faiss_index(doc_texts_on_disk, get_models().embedder):
                     st.session_state['index_built'] = True
                     st.session_state['document_count'] = len(doc_texts_on_disk)
                     st.session_state['current_documents_hash'] = disk_hash
@@ -157,7 +186,7 @@ if st.session_state.get('index_built', False):
     if st.button("Get Answer", key="get_answer_button"):
         if user_query:
             with st.spinner("Searching and generating answer..."):
-                response = core_rag.get_answer_from_rag(user_query)
+                response = asyncio.run(core_rag.get_answer_from_rag(user_query, get_models()))
 
             st.subheader("Answer:")
             st.write(response['answer'])
@@ -169,7 +198,7 @@ if st.session_state.get('index_built', False):
         else:
             st.warning("Please enter a question.")
 else:
-    st.info("Upload documents and click 'Process & Rebuild Knowledge Base' to enable Q&A.")
+    st.info("Upload documents and click 'Add to Knowledge Base' to enable Q&A.")
 
 st.markdown("---")
 st.caption("Powered by Sentence Transformers, FAISS, and Hugging Face Transformers. UI by Streamlit.")
\ No newline at end of file